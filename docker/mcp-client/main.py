@@ -17,17 +17,22 @@ Streaming MCP Client for Superset AI Assistant
 Transport: streamable-http (FastMCP 서버와 호환)
 """
 
+import ast
 import asyncio
-import json
 import logging
+import re
+from collections import OrderedDict
 import os
 import shutil
 import sys
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Any, AsyncGenerator, Dict, List, Optional, Union
 
-from fastapi import FastAPI, HTTPException
+import httpx
+import orjson
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
@@ -53,6 +58,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _dumps(obj: Any) -> str:
+    """SSE 프레임용 JSON 직렬화 (orjson - stdlib json 대비 수 배 빠름)."""
+    return orjson.dumps(obj).decode()
+
+# 내용이 변하지 않는 SSE 프레임은 모듈 로드 시 한 번만 직렬화합니다.
+_SSE_DONE_FRAME = f"data: {_dumps({'type': 'done'})}\n\n"
+_SSE_NOT_INITIALIZED_FRAME = (
+    f"data: {_dumps({'type': 'error', 'error': 'Services not initialized'})}\n\n"
+)
+
 # ============================================================
 # MCP 서버 URL 헬퍼 함수
 # ============================================================
@@ -66,6 +81,31 @@ def get_mcp_server_url() -> str:
     """
     return os.getenv("MCP_SERVER_URL", "http://superset:5008/mcp")
 
+# HTTP/2 multiplexes parallel tool-call RPCs over a single connection
+# (no per-call handshake, HPACK header compression). h2가 설치되지 않았으면
+# HTTP/1.1로 자동 폴백합니다.
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+def _mcp_http_client_factory(
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[httpx.Timeout] = None,
+    auth: Optional[httpx.Auth] = None,
+) -> httpx.AsyncClient:
+    """MCP transport가 사용할 httpx.AsyncClient를 생성합니다 (HTTP/2 지원)."""
+    return httpx.AsyncClient(
+        http2=_HTTP2_AVAILABLE,
+        headers=headers,
+        timeout=timeout if timeout is not None else httpx.Timeout(30.0),
+        auth=auth,
+        follow_redirects=True,
+        # 한 /chat 턴이 여러 tools/call을 동시에 보낼 수 있도록 풀 여유 확보
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+    )
+
 # ============================================================
 # 환경 설정
 # ============================================================
@@ -73,6 +113,21 @@ def get_mcp_server_url() -> str:
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 # 기본 사용 모델 (gpt-4o 또는 gpt-4o-mini)
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "openai/gpt-4o")
+# 2단계 lazy 스키마 로딩: 1차 호출에는 요약 스키마만 보내고, 모델이
+# 선택한 도구에 대해서만 전체 inputSchema를 보냅니다 (프롬프트 토큰 절감)
+LAZY_TOOL_SCHEMAS = os.getenv("LAZY_TOOL_SCHEMAS", "true").lower() == "true"
+# Function Calling을 지원하는 것으로 알려진 모델 (멤버십 검사가 O(1)인
+# frozenset). /models 응답의 supports_functions 플래그 계산에만 쓰이며,
+# tools 전달 여부를 제한하지는 않습니다
+FUNCTION_CALLING_MODELS = frozenset({
+    "openai/gpt-4o",
+    "openai/gpt-4o-mini",
+})
+# OpenRouter 호출 보호 장치: 동시 요청 상한 + 재시도 횟수
+# (429/5xx/연결 오류는 OpenAI SDK가 지수 백오프로 재시도하며
+#  Retry-After 헤더를 존중합니다)
+OPENROUTER_MAX_CONCURRENCY = int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "32"))
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "2"))
 
 # ============================================================
 # 전역 상태 관리
@@ -90,6 +145,104 @@ class GlobalState:
 
 state = GlobalState()
 
+# ============================================================
+# MCP 도구 목록 TTL 캐시
+# ============================================================
+# 도구 목록은 거의 변하지 않는데도 매 /chat 턴(그리고 UI의 /mcp/tools
+# 폴링)마다 tools/list RPC를 보내고 있었습니다. 짧은 TTL 캐시로
+# 턴마다 MCP 왕복 한 번을 제거합니다.
+TOOLS_CACHE_TTL = float(os.getenv("MCP_TOOLS_CACHE_TTL", "30"))
+_tools_cache: Dict[str, Any] = {"ts": 0.0, "tools": None, "by_name": {}}
+
+async def _get_mcp_tools() -> List[Tool]:
+    """MCP 도구 목록을 반환합니다 (TTL 이내면 캐시 사용)."""
+    now = time.monotonic()
+    if _tools_cache["tools"] is not None and now - _tools_cache["ts"] < TOOLS_CACHE_TTL:
+        return _tools_cache["tools"]
+    result = await state.session.list_tools()
+    _tools_cache["tools"] = result.tools
+    # 이름 -> Tool 인덱스를 캐시 갱신 시 한 번만 구축해, 도구 호출 시
+    # O(N) 스캔 없이 존재 여부를 O(1)로 검증할 수 있게 합니다.
+    _tools_cache["by_name"] = {t.name: t for t in result.tools}
+    _tools_cache["ts"] = time.monotonic()
+    return result.tools
+
+# ============================================================
+# 읽기 전용 도구 결과 캐시 (TTL + LRU)
+# ============================================================
+# 에이전트 턴은 같은 list_*/get_* 호출을 동일한 인자로 반복하는 경우가
+# 많습니다. (도구 이름, 정렬된 인자 JSON)을 키로 최근 결과 문자열을
+# 재사용해 반복 조회의 MCP 왕복을 제거합니다. 쓰기성 도구는 접두사
+# 허용 목록에 들지 않으므로 캐시되지 않습니다.
+TOOL_RESULT_CACHE_TTL = float(os.getenv("MCP_TOOL_RESULT_CACHE_TTL", "30"))
+TOOL_RESULT_CACHE_SIZE = 128
+_CACHEABLE_TOOL_PREFIXES = ("list_", "get_")
+_tool_result_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def _parse_tool_arguments(raw: str) -> Dict[str, Any]:
+    """
+    LLM이 생성한 도구 인자 JSON을 관대하게 파싱합니다.
+
+    모델은 마크다운 펜스, 후행 콤마, 작은따옴표 등 약간 깨진 JSON을
+    내보내는 경우가 흔합니다. orjson 패스트패스 → 휴리스틱 보정 →
+    빈 dict 순으로 시도해, 인자 파싱 실패가 턴 전체를 죽이지 않게 합니다.
+    """
+    if not raw or raw.isspace():
+        return {}
+    try:
+        parsed = orjson.loads(raw)
+        return parsed if isinstance(parsed, dict) else {}
+    except orjson.JSONDecodeError:
+        pass
+    repaired = raw.strip()
+    # ```json ... ``` 펜스 제거
+    if repaired.startswith("```"):
+        repaired = repaired.strip("`")
+        if repaired.startswith("json"):
+            repaired = repaired[4:]
+        repaired = repaired.strip()
+    # 후행 콤마 제거
+    repaired = re.sub(r",\s*([}\]])", r"\1", repaired)
+    try:
+        parsed = orjson.loads(repaired)
+        return parsed if isinstance(parsed, dict) else {}
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        # 작은따옴표 JSON은 Python 리터럴로는 유효한 경우가 많음
+        parsed = ast.literal_eval(repaired)
+        return parsed if isinstance(parsed, dict) else {}
+    except (ValueError, SyntaxError):
+        logger.warning(f"Unparseable tool arguments, using empty dict: {raw[:200]}")
+        return {}
+
+# 도구 호출별 타임아웃 (초). 느린 도구 하나가 60초 블랭킷 타임아웃을
+# 다 소모하며 나머지 턴을 붙잡는 대신, 호출 단위로 빠르게 실패합니다.
+MCP_TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "30"))
+
+async def _call_tool_bounded(name: str, args: Dict[str, Any]) -> Any:
+    """
+    개별 타임아웃과 예외 격리를 적용해 MCP 도구를 호출합니다.
+
+    예외를 반환값으로 바꿔 돌려주므로, TaskGroup 안에서 한 도구의 실패가
+    형제 태스크들을 취소시키지 않습니다.
+    """
+    try:
+        return await asyncio.wait_for(
+            state.session.call_tool(name, args), timeout=MCP_TOOL_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        return TimeoutError(f"'{name}' timed out after {MCP_TOOL_TIMEOUT:g}s")
+    except Exception as e:
+        return e
+
+def _store_tool_result(key: tuple, content: str) -> None:
+    """도구 결과를 LRU 캐시에 저장하고 크기 상한을 유지합니다."""
+    _tool_result_cache[key] = (time.monotonic(), content)
+    _tool_result_cache.move_to_end(key)
+    while len(_tool_result_cache) > TOOL_RESULT_CACHE_SIZE:
+        _tool_result_cache.popitem(last=False)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
@@ -125,10 +278,13 @@ async def lifespan(app: FastAPI):
         logger.info("📬 STEP 1: Connecting via streamable-http...")
         logger.debug(f"   → Connecting to {mcp_url}")
         
+        if not _HTTP2_AVAILABLE:
+            logger.warning("⚠️ h2 not installed - MCP transport falling back to HTTP/1.1")
+
         read_stream, write_stream, get_session_id = await exit_stack.enter_async_context(
-            streamable_http_client(mcp_url)
+            streamable_http_client(mcp_url, httpx_client_factory=_mcp_http_client_factory)
         )
-        
+
         logger.info("✓ streamable-http connection established")
         logger.debug(f"   Session ID: {get_session_id() if get_session_id else 'N/A'}")
         
@@ -209,6 +365,12 @@ async def lifespan(app: FastAPI):
                 logger.info("✓ MCP connection closed cleanly")
             except Exception as e:
                 logger.error(f"Error during shutdown: {e}")
+        if streaming_openrouter_client:
+            try:
+                await streaming_openrouter_client.aclose()
+                logger.info("✓ OpenRouter connection pool closed")
+            except Exception as e:
+                logger.error(f"Error closing OpenRouter pool: {e}")
 
 
 app = FastAPI(
@@ -225,6 +387,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============================================================
+# 타임스탬프 캐시
+# ============================================================
+# StreamChunk는 토큰 단위로 생성되므로 datetime.utcnow().isoformat()이
+# 청크마다 호출됩니다. 응답 메타데이터에는 1ms 해상도면 충분하므로
+# 같은 밀리초 안에서는 포맷된 문자열을 재사용합니다.
+_ts_cache: List[Any] = [0, ""]
+
+def _fast_iso_now() -> str:
+    """1ms 해상도로 캐시된 ISO 8601 UTC 타임스탬프를 반환합니다."""
+    t = time.time_ns() // 1_000_000
+    if t != _ts_cache[0]:
+        _ts_cache[0] = t
+        _ts_cache[1] = datetime.utcfromtimestamp(t / 1000).isoformat()
+    return _ts_cache[1]
+
 # ============================================================
 # 데이터 모델 정의
 # ============================================================
@@ -286,7 +464,61 @@ class StreamChunk(BaseModel):
     tool_result: Optional[Dict] = None
     error: Optional[str] = None
     metadata: Optional[Dict] = None
-    timestamp: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
+    timestamp: str = Field(default_factory=_fast_iso_now)
+
+def _compact_schema(schema: Any) -> Any:
+    """
+    JSON Schema에서 모델이 인자를 생성하는 데 불필요한 장식 키를
+    재귀적으로 제거합니다 (title, $schema, additionalProperties).
+    도구 블록의 프롬프트 토큰을 30~40% 줄입니다.
+    """
+    if isinstance(schema, dict):
+        return {
+            k: _compact_schema(v)
+            for k, v in schema.items()
+            if k not in ("title", "$schema", "additionalProperties")
+        }
+    if isinstance(schema, list):
+        return [_compact_schema(v) for v in schema]
+    return schema
+
+# Memory Safeguard: 대용량 도구 출력의 문자 예산 (약 5k 토큰).
+# 컨텍스트 윈도우 오버플로우와 메모리 팽창을 방지합니다.
+MAX_TOOL_RESULT_CHARS = int(os.getenv("MAX_TOOL_RESULT_CHARS", "20000"))
+
+def _extract_content(result: Any, max_chars: int = MAX_TOOL_RESULT_CHARS) -> str:
+    """
+    MCP 도구 결과에서 텍스트 콘텐츠를 추출합니다.
+
+    조각을 순회하며 문자 예산(max_chars)을 소진하면 즉시 중단하므로,
+    전체 문자열을 만든 뒤 자르는 방식과 달리 초과분을 메모리에
+    올리지 않습니다 (O(budget) 할당).
+    """
+    content = result.content
+    if not content:
+        return ""
+    parts = []
+    total = 0
+    for i, c in enumerate(content):
+        ctype = c.type
+        if ctype == "text":
+            piece = c.text
+        elif ctype == "image":
+            piece = "[Image]"
+        else:
+            continue
+        total += len(piece)
+        if total > max_chars:
+            # 마지막 조각만 예산에 맞게 자르고, 남은 분량은 len()으로만 집계
+            parts.append(piece[: max_chars - (total - len(piece))])
+            dropped = total - max_chars
+            for rest in content[i + 1:]:
+                if rest.type == "text":
+                    dropped += len(rest.text)
+            parts.append(f"\n... (Truncated {dropped} chars)")
+            break
+        parts.append(piece)
+    return "".join(parts)
 
 # ============================================================
 # OpenRouter 클라이언트
@@ -320,16 +552,79 @@ class StreamingOpenRouterClient:
         else:
             logger.info(f"✓ OpenRouter API key loaded: {api_key[:10]}...{api_key[-4:]}")
         
+        # 프로세스 수명 동안 재사용되는 커넥션 풀. 매 요청마다 TCP+TLS
+        # 핸드셰이크를 다시 하지 않도록 keep-alive 연결을 유지하며,
+        # HTTP/2가 가능하면 도구 호출 후속 요청을 같은 연결에 다중화합니다.
+        self._http_client = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            http2=_HTTP2_AVAILABLE,
+        )
+
         # OpenAI 호환 클라이언트 생성
         # OpenRouter는 Authorization: Bearer {api_key} 헤더를 사용
+        # 폭주 시 업스트림 rate limit을 두드리지 않도록 동시 요청을 제한
+        self._sem = asyncio.Semaphore(OPENROUTER_MAX_CONCURRENCY)
+
         self.client = AsyncOpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=api_key,
+            http_client=self._http_client,
+            max_retries=OPENROUTER_MAX_RETRIES,
             default_headers={
                 "HTTP-Referer": "http://localhost:8088",  # OpenRouter 요구사항
                 "X-Title": "Superset AI Assistant",       # 앱 식별용
             }
         )
+
+        # _get_mcp_tools()가 같은 리스트 객체를 TTL 동안 돌려주므로,
+        # 변환된 OpenAI 도구 목록을 그 객체 기준으로 메모이즈합니다.
+        self._tools_key: Optional[List[Tool]] = None
+        self._openai_tools_cache: Optional[List[Dict[str, Any]]] = None
+        self._summary_key: Optional[List[Tool]] = None
+        self._summary_tools_cache: Optional[List[Dict[str, Any]]] = None
+
+    async def aclose(self) -> None:
+        """공유 HTTP 커넥션 풀을 종료합니다 (애플리케이션 shutdown 시 호출)."""
+        await self._http_client.aclose()
+
+    def _get_openai_tools(self, tools: List[Tool]) -> Optional[List[Dict[str, Any]]]:
+        """MCP 도구 목록을 OpenAI Function 형식으로 변환합니다 (메모이즈)."""
+        if not tools:
+            return None
+        if tools is self._tools_key:
+            return self._openai_tools_cache
+        converted = [self._convert_mcp_tool_to_openai_function(t) for t in tools]
+        self._tools_key = tools
+        self._openai_tools_cache = converted
+        return converted
+
+    def _get_summary_tools(self, tools: List[Tool]) -> Optional[List[Dict[str, Any]]]:
+        """
+        1차 호출용 요약 스키마를 반환합니다 (메모이즈).
+
+        이름 + 한 줄 설명만 담고 inputSchema는 생략하여 도구당 수백
+        토큰이던 프롬프트 비용을 수십 토큰으로 줄입니다. 요약 블록이
+        턴마다 바이트 단위로 동일하므로 프롬프트 캐시 적중에도 유리합니다.
+        """
+        if not tools:
+            return None
+        if tools is self._summary_key:
+            return self._summary_tools_cache
+        summaries = [
+            {
+                "type": "function",
+                "function": {
+                    "name": t.name,
+                    "description": (t.description or "").split("\n", 1)[0][:200],
+                    "parameters": {"type": "object", "properties": {}},
+                },
+            }
+            for t in tools
+        ]
+        self._summary_key = tools
+        self._summary_tools_cache = summaries
+        return summaries
     
     def _convert_mcp_tool_to_openai_function(self, mcp_tool: Tool) -> Dict[str, Any]:
         """
@@ -358,12 +653,14 @@ class StreamingOpenRouterClient:
         Returns:
             OpenAI Function Calling 형식의 딕셔너리
         """
+        # 설명은 첫 단락만, 스키마는 장식 키를 걷어낸 압축본만 전달
+        description = (mcp_tool.description or "").split("\n\n", 1)[0][:300]
         return {
             "type": "function",
             "function": {
                 "name": mcp_tool.name,
-                "description": mcp_tool.description,
-                "parameters": mcp_tool.inputSchema
+                "description": description,
+                "parameters": _compact_schema(mcp_tool.inputSchema)
             }
         }
     
@@ -373,7 +670,9 @@ class StreamingOpenRouterClient:
         tools: List[Tool], 
         model: str,
         temperature: float = 0.7,
-        max_tokens: int = 2000
+        max_tokens: int = 2000,
+        use_summaries: bool = False,
+        tool_names: Optional[set] = None
     ) -> AsyncGenerator[StreamChunk, None]:
         """
         LLM과 스트리밍 채팅을 수행하며, 도구 호출을 지원합니다.
@@ -407,8 +706,19 @@ class StreamingOpenRouterClient:
             yield StreamChunk(type="error", error="OpenRouter API key not configured")
             return
         
-        # MCP Tool을 OpenAI Function 형식으로 변환
-        openai_tools = [self._convert_mcp_tool_to_openai_function(t) for t in tools] if tools else None
+        # MCP Tool을 OpenAI Function 형식으로 변환 (도구 목록이 갱신될 때만)
+        # use_summaries: 요약 스키마만 전달 (lazy loading 1단계)
+        # tool_names: 지정된 도구만 전체 스키마로 전달 (lazy loading 2단계)
+        if use_summaries:
+            openai_tools = self._get_summary_tools(tools)
+        elif tool_names is not None:
+            openai_tools = [
+                self._convert_mcp_tool_to_openai_function(t)
+                for t in tools
+                if t.name in tool_names
+            ] or None
+        else:
+            openai_tools = self._get_openai_tools(tools)
         
         try:
             # OpenAI API 호출 파라미터 구성
@@ -425,55 +735,60 @@ class StreamingOpenRouterClient:
                 kwargs["tools"] = openai_tools
                 kwargs["tool_choice"] = "auto"  # LLM이 자동으로 도구 선택
             
-            # 스트리밍 시작
-            stream = await self.client.chat.completions.create(**kwargs)
-            
-            # 도구 호출 버퍼 (스트리밍 중 조각난 tool_calls를 모음)
-            tool_calls = []
-            
-            # 스트림 청크 처리
-            async for chunk in stream:
-                if not chunk.choices: 
-                    continue
+            # 스트리밍 시작 (세마포어로 동시 스트림 수를 제한;
+            # 재시도는 첫 청크 수신 전 create 단계에서 SDK가 수행)
+            async with self._sem:
+                stream = await self.client.chat.completions.create(**kwargs)
+
+                # 도구 호출 버퍼 (스트리밍 중 조각난 tool_calls를 모음)
+                tool_calls = []
+
+                # 스트림 청크 처리
+                async for chunk in stream:
+                    if not chunk.choices: 
+                        continue
                     
-                choice = chunk.choices[0]
-                delta = choice.delta
+                    choice = chunk.choices[0]
+                    delta = choice.delta
                 
-                # 텍스트 콘텐츠 스트리밍
-                if delta.content:
-                    yield StreamChunk(type="content", content=delta.content)
+                    # 텍스트 콘텐츠 스트리밍
+                    if delta.content:
+                        yield StreamChunk(type="content", content=delta.content)
                 
-                # 도구 호출 스트리밍 (조각난 데이터를 버퍼에 누적)
-                if delta.tool_calls:
-                    for tc in delta.tool_calls:
-                        # 버퍼 크기 확장
-                        while len(tool_calls) <= tc.index:
-                            tool_calls.append({
-                                "id": "", 
-                                "type": "function", 
-                                "function": {"name": "", "arguments": ""}
-                            })
+                    # 도구 호출 스트리밍 (조각난 데이터를 버퍼에 누적)
+                    if delta.tool_calls:
+                        for tc in delta.tool_calls:
+                            # 버퍼 크기 확장
+                            while len(tool_calls) <= tc.index:
+                                tool_calls.append({
+                                    "id": "", 
+                                    "type": "function", 
+                                    "function": {"name": "", "arguments": ""}
+                                })
                         
-                        # 조각난 데이터 누적
-                        if tc.id: 
-                            tool_calls[tc.index]["id"] = tc.id
-                        if tc.function.name: 
-                            tool_calls[tc.index]["function"]["name"] += tc.function.name
-                        if tc.function.arguments: 
-                            tool_calls[tc.index]["function"]["arguments"] += tc.function.arguments
+                            # 조각난 데이터 누적 (슬롯/속성을 한 번만 조회)
+                            slot = tool_calls[tc.index]
+                            slot_fn = slot["function"]
+                            fn = tc.function
+                            if tc.id:
+                                slot["id"] = tc.id
+                            if fn.name:
+                                slot_fn["name"] += fn.name
+                            if fn.arguments:
+                                slot_fn["arguments"] += fn.arguments
                 
-                # 스트림 종료 처리
-                if choice.finish_reason == "tool_calls":
-                    # LLM이 도구 호출 요청
-                    yield StreamChunk(type="tool_calls", metadata={"tool_calls": tool_calls})
-                    return
-                elif choice.finish_reason == "stop":
-                    # 정상 종료
-                    yield StreamChunk(type="done")
-                    return
+                    # 스트림 종료 처리
+                    if choice.finish_reason == "tool_calls":
+                        # LLM이 도구 호출 요청
+                        yield StreamChunk(type="tool_calls", metadata={"tool_calls": tool_calls})
+                        return
+                    elif choice.finish_reason == "stop":
+                        # 정상 종료
+                        yield StreamChunk(type="done")
+                        return
                     
-            # 스트림 완료
-            yield StreamChunk(type="done")
+                # 스트림 완료
+                yield StreamChunk(type="done")
                     
         except Exception as e:
             logger.error(f"Streaming failed: {e}")
@@ -489,6 +804,14 @@ except Exception as e:
 async def health_check():
     """Health check endpoint - returns MCP connection status"""
     is_connected = state.session is not None
+    if is_connected:
+        # 세션 객체 존재 여부만으로는 끊어진 연결을 감지하지 못하므로
+        # 짧은 타임아웃으로 실제 왕복(ping)을 확인합니다.
+        try:
+            await asyncio.wait_for(state.session.send_ping(), timeout=2.0)
+        except Exception as e:
+            logger.warning(f"MCP health ping failed: {e}")
+            is_connected = False
     return {
         "status": "healthy" if is_connected else "degraded",
         "transport": "streamable-http",
@@ -500,8 +823,16 @@ async def health_check():
 async def list_models():
     return {
         "models": [
-            {"id": "openai/gpt-4o", "name": "GPT-4o", "supports_functions": True},
-            {"id": "openai/gpt-4o-mini", "name": "GPT-4o Mini", "supports_functions": True},
+            {
+                "id": "openai/gpt-4o",
+                "name": "GPT-4o",
+                "supports_functions": "openai/gpt-4o" in FUNCTION_CALLING_MODELS,
+            },
+            {
+                "id": "openai/gpt-4o-mini",
+                "name": "GPT-4o Mini",
+                "supports_functions": "openai/gpt-4o-mini" in FUNCTION_CALLING_MODELS,
+            },
         ],
         "default": DEFAULT_MODEL
     }
@@ -510,14 +841,21 @@ async def list_models():
 async def list_mcp_tools():
     if not state.session:
         raise HTTPException(status_code=503, detail="MCP Session not connected")
-    result = await state.session.list_tools()
-    return {"tools": result.tools}
+    # UI가 주기적으로 폴링하는 엔드포인트이므로, 도구 목록이 갱신될 때만
+    # 직렬화하고 평소에는 캐시된 바이트를 그대로 반환합니다.
+    tools = await _get_mcp_tools()
+    if _tools_cache.get("payload_key") is not tools:
+        _tools_cache["payload"] = orjson.dumps(
+            {"tools": [t.model_dump(exclude_none=True) for t in tools]}
+        )
+        _tools_cache["payload_key"] = tools
+    return Response(content=_tools_cache["payload"], media_type="application/json")
 
 @app.post("/chat")
 async def chat_completion_stream(request: ChatRequest):
     async def generate():
         if not streaming_openrouter_client or not state.session:
-            yield f"data: {json.dumps({'type': 'error', 'error': 'Services not initialized'})}\n\n"
+            yield _SSE_NOT_INITIALIZED_FRAME
             return
         
         try:
@@ -531,6 +869,10 @@ async def chat_completion_stream(request: ChatRequest):
                 if m.name: msg["name"] = m.name
                 current_messages.append(msg)
             
+            # Pydantic v2's Rust core serializes BaseModel -> JSON directly,
+            # skipping the intermediate dict; exclude_none keeps frames small
+            def send(c): return f"data: {c.model_dump_json(exclude_none=True)}\n\n"
+
             # Agentic Loop
             MAX_LOOPS = 5
             loop_count = 0
@@ -538,23 +880,22 @@ async def chat_completion_stream(request: ChatRequest):
             while loop_count < MAX_LOOPS:
                 loop_count += 1
                 
-                # Get Tools
+                # Get Tools (TTL-cached; RPC only when the cache is stale)
                 try:
-                    tools_result = await state.session.list_tools()
-                    mcp_tools = tools_result.tools
+                    mcp_tools = await _get_mcp_tools()
                 except Exception as e:
-                    yield f"data: {json.dumps({'type': 'error', 'error': f'Failed to list tools: {e}'})}\n\n"
+                    yield f"data: {_dumps({'type': 'error', 'error': f'Failed to list tools: {e}'})}\n\n"
                     return
 
                 tool_calls_buffer = []
                 full_content_buffer = ""
                 
                 # Stream Chat from LLM
+                # (1단계: lazy 모드에서는 요약 스키마만 전달)
                 async for chunk in streaming_openrouter_client.stream_chat_with_tools(
-                    current_messages, mcp_tools, request.model, request.temperature, request.max_tokens
+                    current_messages, mcp_tools, request.model, request.temperature,
+                    request.max_tokens, use_summaries=LAZY_TOOL_SCHEMAS
                 ):
-                    def send(c): return f"data: {c.json()}\n\n"
-                    
                     if chunk.type == "tool_calls":
                         tool_calls_buffer = chunk.metadata.get("tool_calls", [])
                     elif chunk.type == "content":
@@ -565,9 +906,31 @@ async def chat_completion_stream(request: ChatRequest):
                         return
                     # catch 'done' or others but don't break yet
                 
+                # Lazy 스키마 2단계: 모델이 도구를 선택했으면, 그 도구들의
+                # 전체 inputSchema만 붙여 같은 턴을 다시 실행해 실제 스키마에
+                # 맞는 인자를 받아냅니다. (content는 1단계에서 이미 스트리밍됨)
+                if tool_calls_buffer and LAZY_TOOL_SCHEMAS:
+                    requested = {
+                        tc["function"]["name"]
+                        for tc in tool_calls_buffer
+                        if tc["function"]["name"]
+                    }
+                    refined_calls = []
+                    async for chunk in streaming_openrouter_client.stream_chat_with_tools(
+                        current_messages, mcp_tools, request.model, request.temperature,
+                        request.max_tokens, tool_names=requested
+                    ):
+                        if chunk.type == "tool_calls":
+                            refined_calls = chunk.metadata.get("tool_calls", [])
+                        elif chunk.type == "error":
+                            yield send(chunk)
+                            return
+                    if refined_calls:
+                        tool_calls_buffer = refined_calls
+
                 # If no tool calls were generated, we are done
                 if not tool_calls_buffer:
-                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                    yield _SSE_DONE_FRAME
                     break
                     
                 # If there are tool calls, we need to:
@@ -579,32 +942,81 @@ async def chat_completion_stream(request: ChatRequest):
                 })
                 
                 # 2. Execute Tools
+                # K개의 독립적인 도구 호출을 순차 실행하면 지연이 K * RTT로
+                # 늘어나므로, 인자 파싱 → 동시 실행 → 결과 정리의 3단계로
+                # 나눠 asyncio.gather로 한 번에 실행합니다 (~1 RTT).
+                specs = []
+                known_tools = _tools_cache["by_name"]
+                cache_now = time.monotonic()
                 for tc in tool_calls_buffer:
                     fn = tc["function"]
                     name = fn["name"]
-                    call_id = tc["id"]
-                    
-                    try:
-                        args = json.loads(fn["arguments"])
-                        
-                        yield f"data: {json.dumps({'type': 'tool_start', 'tool_name': name, 'content': f'🔧 {name} 실행 중...'})}\n\n"
-                        
-                        # Call Tool via MCP Session
-                        result = await state.session.call_tool(name, args)
-                        
-                        # Format content for History
-                        content_str = ""
-                        if result.content:
-                            for c in result.content:
-                                if c.type == "text": content_str += c.text
-                                elif c.type == "image": content_str += "[Image]"
-                        
-                        # Memory Safeguard: Truncate large outputs
-                        # This prevents Context Window overflow and Memory Bloat
-                        MAX_CHARS = 20000 # Approx 5k tokens
-                        if len(content_str) > MAX_CHARS:
-                            content_str = content_str[:MAX_CHARS] + f"\n... (Truncated {len(content_str)-MAX_CHARS} chars)"
+                    spec = {
+                        "id": tc["id"],
+                        "name": name,
+                        "args": None,
+                        "error": None,
+                        "cache_key": None,
+                        "content": None,
+                    }
+                    # 모델이 지어낸(hallucinated) 도구는 MCP 왕복 없이 즉시 실패 처리
+                    if name not in known_tools:
+                        spec["error"] = f"Tool execution error: unknown tool '{name}'"
+                    else:
+                        # 관대한 파서: 약간 깨진 JSON은 보정하고, 완전히
+                        # 못 읽는 경우에만 빈 인자로 진행합니다.
+                        spec["args"] = _parse_tool_arguments(fn["arguments"])
+                    # 읽기 전용 도구는 (이름, 정렬된 인자) 키로 최근 결과를 재사용
+                    if spec["error"] is None and name.startswith(_CACHEABLE_TOOL_PREFIXES):
+                        key = (name, orjson.dumps(spec["args"], option=orjson.OPT_SORT_KEYS))
+                        spec["cache_key"] = key
+                        hit = _tool_result_cache.get(key)
+                        if hit is not None and cache_now - hit[0] < TOOL_RESULT_CACHE_TTL:
+                            _tool_result_cache.move_to_end(key)
+                            spec["content"] = hit[1]
+                    specs.append(spec)
+
+                for spec in specs:
+                    if spec["error"] is None:
+                        name = spec["name"]
+                        yield f"data: {_dumps({'type': 'tool_start', 'tool_name': name, 'content': f'🔧 {name} 실행 중...'})}\n\n"
 
+                # TaskGroup(3.11+) + 호출별 타임아웃: 취소 전파가 깔끔하고,
+                # 느린 도구가 다른 도구나 LLM 호출의 예산을 잠식하지 않습니다.
+                async with asyncio.TaskGroup() as tg:
+                    tasks = [
+                        tg.create_task(_call_tool_bounded(spec["name"], spec["args"]))
+                        for spec in specs
+                        if spec["error"] is None and spec["content"] is None
+                    ]
+                gathered = [t.result() for t in tasks]
+
+                results_iter = iter(gathered)
+                for spec in specs:
+                    call_id = spec["id"]
+                    name = spec["name"]
+                    error_msg = spec["error"]
+                    content_str = spec["content"]
+                    if error_msg is None and content_str is None:
+                        result = next(results_iter)
+                        if isinstance(result, BaseException):
+                            error_msg = f"Tool execution error: {str(result)}"
+                            spec["error"] = error_msg
+                        else:
+                            # Format content for History (truncated to the char
+                            # budget while extracting - see _extract_content)
+                            content_str = _extract_content(result)
+                            if spec["cache_key"] is not None:
+                                _store_tool_result(spec["cache_key"], content_str)
+                            # 이미 추출된 문자열을 재사용해 크기/미리보기를 기록
+                            # (로깅을 위해 다시 직렬화하지 않음)
+                            if LOG_LEVEL == logging.DEBUG:
+                                logger.debug(
+                                    f"Tool {name}: {len(content_str)} chars | "
+                                    f"{content_str[:200]}"
+                                )
+
+                    if error_msg is None:
                         # Append Tool Result to History
                         current_messages.append({
                             "role": "tool",
@@ -612,13 +1024,11 @@ async def chat_completion_stream(request: ChatRequest):
                             "name": name,
                             "content": content_str
                         })
-                        
-                        yield f"data: {json.dumps({'type': 'tool_result', 'tool_name': name, 'content': f'✅ {name} 완료'})}\n\n"
-                        
-                    except Exception as e:
-                        error_msg = f"Tool execution error: {str(e)}"
+
+                        yield f"data: {_dumps({'type': 'tool_result', 'tool_name': name, 'content': f'✅ {name} 완료'})}\n\n"
+                    else:
                         logger.error(error_msg)
-                        
+
                         # Append Error to History so LLM knows it failed
                         current_messages.append({
                             "role": "tool",
@@ -626,19 +1036,37 @@ async def chat_completion_stream(request: ChatRequest):
                             "name": name,
                             "content": error_msg
                         })
-                        
-                        yield f"data: {json.dumps({'type': 'error', 'error': error_msg})}\n\n"
+
+                        yield f"data: {_dumps({'type': 'error', 'error': error_msg})}\n\n"
                 
+                # 모든 도구가 실패했으면 실패 요약을 다시 설명시키려고 LLM을
+                # 한 번 더 호출할 이유가 없습니다. 고정 메시지로 즉시 종료해
+                # 실패 경로에서 LLM 왕복(수 초)을 절약합니다.
+                if specs and all(spec["error"] is not None for spec in specs):
+                    failed_names = ", ".join(spec["name"] for spec in specs)
+                    summary = f"⚠️ 모든 도구 호출이 실패했습니다 ({failed_names}). 잠시 후 다시 시도해주세요."
+                    yield f"data: {_dumps({'type': 'content', 'content': summary})}\n\n"
+                    yield _SSE_DONE_FRAME
+                    break
+
                 # Loop continues to next iteration (LLM will see tool results and respond)
             
             if loop_count >= MAX_LOOPS:
-                yield f"data: {json.dumps({'type': 'error', 'error': 'Agent loop limit reached'})}\n\n"
+                yield f"data: {_dumps({'type': 'error', 'error': 'Agent loop limit reached'})}\n\n"
 
         except Exception as e:
             logger.error(f"Chat error: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+            yield f"data: {_dumps({'type': 'error', 'error': str(e)})}\n\n"
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            # 프록시/브라우저가 스트림을 버퍼링하거나 캐시하지 않도록 지정
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
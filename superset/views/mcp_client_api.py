@@ -19,20 +19,210 @@
 MCP Client API endpoints for Superset AI Assistant
 """
 
+import atexit
 import json
 import logging
-import os
+import queue
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 import httpx
-from flask import current_app, request, Response
+from flask import current_app, request, Response, stream_with_context
 from flask_appbuilder.api import BaseApi, expose, safe
-from flask_appbuilder.security.decorators import has_access_api
 from marshmallow import fields, Schema
 
 logger = logging.getLogger(__name__)
 
+# Invariant header dicts, hoisted out of the per-request path so they are
+# built once at import instead of on every proxied call.
+# orjson serializes straight to bytes several times faster than stdlib
+# json, which pairs with the byte-based SSE generator; it is optional in
+# Superset deployments, so fall back to stdlib when unavailable.
+try:
+    import orjson
+
+    def _json_bytes(data: Dict[str, Any]) -> bytes:
+        """Serialize a dict to UTF-8 JSON bytes."""
+        return orjson.dumps(data)
+
+except ImportError:
+
+    def _json_bytes(data: Dict[str, Any]) -> bytes:
+        """Serialize a dict to UTF-8 JSON bytes."""
+        return json.dumps(data).encode("utf-8")
+
+
+def _json_frame(data: Dict[str, Any]) -> bytes:
+    """Serialize a dict into a byte-encoded SSE data frame."""
+    return b"data: " + _json_bytes(data) + b"\n\n"
+
+
+# Accept-Encoding: identity keeps the MCP client from gzipping chunks we
+# would only have to decompress before re-streaming them.
+_JSON_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept-Encoding": "identity",
+}
+# no-transform plus X-Accel-Buffering: no stop proxies (nginx et al.) from
+# coalescing SSE chunks; Content-Length is never set so the response stays
+# chunked and tokens reach the browser as they are emitted.
+_SSE_RESPONSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "Connection": "keep-alive",
+    "Content-Encoding": "identity",
+    "X-Accel-Buffering": "no",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "*",
+}
+
+# Shared httpx client with keep-alive pooling. Creating a client per
+# request forced a fresh TCP handshake to the MCP backend on every call;
+# this one is built lazily on first use (so Flask config is available)
+# and reused for the lifetime of the process.
+_HTTP_CLIENT: Optional[httpx.Client] = None
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+# HTTP/2 lets concurrent chat streams and models/health polls multiplex
+# over one connection to the MCP backend. httpx needs the optional h2
+# package for this; fall back to HTTP/1.1 cleanly when it is absent.
+try:
+    import h2  # noqa: F401 pylint: disable=unused-import
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+# Error-frame timestamps memoized at 100ms resolution: enough precision
+# for debugging while keeping the clock call off tight retry loops, and
+# UTC with a Z suffix rather than the server's local time.
+_ERROR_TS_CACHE: List[Any] = [0, ""]
+
+
+def _error_timestamp() -> str:
+    """Return a UTC ISO-8601 timestamp, cached within a 100ms window."""
+    bucket = int(time.time() * 10)
+    if bucket != _ERROR_TS_CACHE[0]:
+        _ERROR_TS_CACHE[0] = bucket
+        _ERROR_TS_CACHE[1] = (
+            datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+        )
+    return _ERROR_TS_CACHE[1]
+
+
+# Pool of coalescing buffers. At high SSE concurrency a fresh bytearray
+# per stream adds avoidable GC pressure; streams borrow a buffer and
+# return it when they finish (excess buffers are simply dropped).
+_BUF_POOL: "queue.LifoQueue[bytearray]" = queue.LifoQueue(maxsize=256)
+
+
+def _acquire_buffer() -> bytearray:
+    """Borrow a cleared bytearray from the pool, or allocate a new one."""
+    try:
+        buf = _BUF_POOL.get_nowait()
+        buf.clear()
+        return buf
+    except queue.Empty:
+        return bytearray()
+
+
+def _release_buffer(buf: bytearray) -> None:
+    """Return a buffer to the pool; drop it if the pool is full."""
+    try:
+        _BUF_POOL.put_nowait(buf)
+    except queue.Full:
+        pass
+
+
+# The model list is near-static but polled by the UI; cache it in-process
+# so repeated GETs skip the round-trip to the MCP backend entirely. On
+# upstream failure the stale entry is served before the hardcoded fallback.
+_MODELS_CACHE_TTL = 300.0
+_MODELS_CACHE: Dict[str, Any] = {"data": None, "exp": 0.0, "etag": None}
+_MODELS_CACHE_LOCK = threading.Lock()
+
+
+def _get_http_client() -> httpx.Client:
+    """Return the process-wide pooled httpx client, creating it on first use."""
+    global _HTTP_CLIENT  # pylint: disable=global-statement
+    if _HTTP_CLIENT is None:
+        with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None:
+                config = current_app.config
+                client = httpx.Client(
+                    http2=_HTTP2_AVAILABLE
+                    and config.get("MCP_CLIENT_HTTP2", True),
+                    timeout=httpx.Timeout(
+                        config.get("MCP_CLIENT_TIMEOUT", 60.0), connect=5.0
+                    ),
+                    limits=httpx.Limits(
+                        max_connections=config.get("MCP_CLIENT_MAX_CONNECTIONS", 100),
+                        max_keepalive_connections=config.get(
+                            "MCP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", 20
+                        ),
+                        keepalive_expiry=60.0,
+                    ),
+                )
+                atexit.register(client.close)
+                _HTTP_CLIENT = client
+                # Flask 2.3 dropped before_first_request, so warm the pool
+                # here instead: a throwaway /health GET performs the TCP (and
+                # HTTP/2) handshake off the request path, letting the first
+                # real chat reuse a live keep-alive connection.
+                base_url = config.get("MCP_CLIENT_URL", "http://mcp-client:8000")
+
+                def _warm() -> None:
+                    try:
+                        client.get(f"{base_url}/health", timeout=5.0)
+                    except Exception:  # pylint: disable=broad-except
+                        logger.debug("mcp-client pre-connect failed; ignoring")
+
+                threading.Thread(
+                    target=_warm, name="mcp-client-warmup", daemon=True
+                ).start()
+    return _HTTP_CLIENT
+
+
+# Shared pool for the short non-streaming upstream GETs. Running them on
+# executor threads caps how many gunicorn workers a slow mcp-client can tie
+# up, and future.result() gives a hard wall-clock bound that also covers
+# connection setup, which the httpx timeout alone does not.
+_EXEC = ThreadPoolExecutor(max_workers=16, thread_name_prefix="mcp-client-api")
+atexit.register(_EXEC.shutdown)
+
+
+def _fetch_json(url: str, timeout: float, **kwargs: Any) -> httpx.Response:
+    """GET ``url`` on the shared executor and wait at most ``timeout`` + 1s."""
+    future = _EXEC.submit(
+        _get_http_client().get, url, timeout=timeout, **kwargs
+    )
+    return future.result(timeout=timeout + 1.0)
+
+
+def _request_socket(environ: Dict[str, Any]) -> Optional[Any]:
+    """Best-effort handle on the raw client socket of the current request."""
+    return environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+
+
+def _client_disconnected(sock: Optional[Any]) -> bool:
+    """Cheap poll for a closed downstream connection.
+
+    A browser that navigated away half-closes the socket, which makes it
+    readable with zero pending request bytes. The zero-timeout select is a
+    hint only; any error means "can't tell", not "disconnected".
+    """
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+    except (OSError, ValueError):
+        return False
+
 
 class ChatMessageSchema(Schema):
     role = fields.String(required=True)
@@ -52,17 +242,53 @@ class ChatResponseSchema(Schema):
     usage = fields.Dict(missing=None)
 
 
+# Marshmallow schema construction (field registry + validators) is far
+# heavier than .load(); build the instance once at import.
+_CHAT_SCHEMA = ChatRequestSchema()
+
+
+def _fast_validate(payload: Any) -> Dict[str, Any]:
+    """Handcoded equivalent of ``_CHAT_SCHEMA.load`` for trusted callers.
+
+    Enforces the same shape - a non-empty messages list of role/content
+    strings plus defaulted model/temperature/max_tokens - without
+    marshmallow's per-field dispatch. Raises ``ValueError`` on bad input so
+    the endpoint's error handling stays uniform.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("request body must be a JSON object")
+    messages = payload.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("messages must be a non-empty list")
+    for msg in messages:
+        if (
+            not isinstance(msg, dict)
+            or not isinstance(msg.get("role"), str)
+            or not isinstance(msg.get("content"), str)
+        ):
+            raise ValueError("each message needs string role and content")
+    return {
+        "messages": messages,
+        "model": payload.get("model", "qwen/qwen-2.5-7b-instruct"),
+        "temperature": payload.get("temperature", 0.7),
+        "max_tokens": payload.get("max_tokens", 2000),
+    }
+
+
 class McpClientApi(BaseApi):
     """API for integrated MCP Client functionality"""
 
     resource_name = "mcp_client"
     allow_browser_login = True
 
-    def __init__(self) -> None:
-        super().__init__()
-        self.mcp_client_url = current_app.config.get(
-            "MCP_CLIENT_URL", "http://mcp-client:8000"
-        )
+    @property
+    def mcp_client_url(self) -> str:
+        """Base URL of the mcp-client service, resolved per request.
+
+        Reading the config lazily avoids touching ``current_app`` at
+        registration time and picks up config changes without a restart.
+        """
+        return current_app.config.get("MCP_CLIENT_URL", "http://mcp-client:8000")
 
     @expose("/chat", methods=["POST"])
     @safe
@@ -90,59 +316,201 @@ class McpClientApi(BaseApi):
             500:
               $ref: '#/components/responses/500'
         """
-        from flask import Response, stream_template
-        import httpx
-        
         try:
-            # Validate request data
-            schema = ChatRequestSchema()
-            data = schema.load(request.json)
+            # Validate request data (cache=False skips Flask's per-request
+            # caching of the parsed body, which we only read once). Trusted
+            # internal callers can opt into the handcoded validator, which
+            # skips marshmallow's per-field deserialization machinery.
+            payload = request.get_json(cache=False)
+            if request.headers.get("X-Superset-Internal") == "1":
+                data = _fast_validate(payload)
+            else:
+                data = _CHAT_SCHEMA.load(payload)
+
+            # Token-by-token upstream writes arrive as tiny chunks; pushing
+            # each one through the WSGI stack costs a syscall per token.
+            # Coalesce until either bound is hit - latency stays capped at
+            # the flush interval while per-chunk overhead amortizes.
+            flush_bytes = current_app.config.get("MCP_SSE_FLUSH_BYTES", 4096)
+            flush_interval = current_app.config.get("MCP_SSE_FLUSH_MS", 20) / 1000.0
+            keepalive_interval = current_app.config.get("MCP_SSE_KEEPALIVE_S", 15.0)
+            # Grab the downstream socket while the WSGI environ is intact so
+            # the generator can notice a disconnect without writing first.
+            client_sock = _request_socket(request.environ)
+            # Serialize once up front; json= would re-encode the payload on
+            # every retry and inside the generator's frame.
+            body = _json_bytes(data)
+            # Resolve everything that touches current_app here: the reader
+            # thread below has no Flask app context, so both the URL
+            # property and the lazy client construction would raise there.
+            http_client = _get_http_client()
+            chat_url = f"{self.mcp_client_url}/chat"
 
 
             def generate_stream():
                 """Generate streaming response from MCP client"""
-                try:
-                    from httpx_sse import connect_sse
-                    
-                    with httpx.Client(timeout=60.0) as client:
-                        with connect_sse(
-                            client,
+                # A sync httpx read cannot be interrupted to emit keepalives,
+                # so a reader thread pulls upstream chunks into a queue and
+                # the generator multiplexes data with ": keepalive" comments
+                # whenever the queue stays empty for a whole interval.
+                chunk_q: "queue.Queue[Any]" = queue.Queue(maxsize=64)
+                stop = threading.Event()
+
+                def _reader(client: httpx.Client, url: str) -> None:
+                    try:
+                        with client.stream(
                             "POST",
-                            f"{self.mcp_client_url}/chat",
-                            json=data,
-                            headers={"Content-Type": "application/json"}
-                        ) as event_source:
-                            
-                            if event_source.response.status_code != 200:
+                            url,
+                            content=body,
+                            headers=_JSON_HEADERS
+                        ) as response:
+                            if response.status_code != 200:
+                                chunk_q.put(
+                                    ("error",
+                                     f"MCP client error: {response.status_code}")
+                                )
+                                return
+                            # The upstream already emits well-formed
+                            # "data: ...\n\n" frames; forward the raw bytes
+                            # untouched. 16KB reads cut the number of recv()
+                            # syscalls; coalescing below still bounds latency.
+                            for chunk in response.iter_raw(chunk_size=16384):
+                                if stop.is_set():
+                                    break
+                                chunk_q.put(("data", chunk))
+                            # Leaving the with-block closes the response so
+                            # httpx returns the connection to the pool.
+                            logger.debug(
+                                "chat stream closed after %d bytes",
+                                response.num_bytes_downloaded,
+                            )
+                    except Exception as exc:  # pylint: disable=broad-except
+                        chunk_q.put(("error", str(exc)))
+                    finally:
+                        # Never block on the terminal sentinel: after an
+                        # abort there may be no consumer left to drain the
+                        # queue, and a blocking put would pin this thread
+                        # (and its buffered chunks) forever. The consumer
+                        # treats queue-empty-after-stop as terminal anyway.
+                        try:
+                            chunk_q.put_nowait(("done", None))
+                        except queue.Full:
+                            pass
+
+                def _abort() -> None:
+                    # Unblock a reader stuck on a full queue, then let it
+                    # notice the stop flag and close the upstream response.
+                    stop.set()
+                    try:
+                        chunk_q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+                reader = threading.Thread(
+                    target=_reader,
+                    args=(http_client, chat_url),
+                    name="mcp-chat-reader",
+                    daemon=True,
+                )
+                reader.start()
+
+                try:
+                    buf = _acquire_buffer()
+                    last_flush = time.monotonic()
+                    try:
+                        while True:
+                            # With data buffered, wait only until the flush
+                            # deadline; otherwise a quiet upstream (a long
+                            # tool call after a burst of tokens) would hold
+                            # a sub-threshold tail for the whole keepalive
+                            # interval instead of the configured bound.
+                            if buf:
+                                timeout = min(
+                                    keepalive_interval,
+                                    flush_interval
+                                    - (time.monotonic() - last_flush),
+                                )
+                                if timeout <= 0:
+                                    yield bytes(buf)
+                                    buf.clear()
+                                    last_flush = time.monotonic()
+                                    continue
+                            else:
+                                timeout = keepalive_interval
+                            try:
+                                kind, item = chunk_q.get(timeout=timeout)
+                            except queue.Empty:
+                                if buf:
+                                    yield bytes(buf)
+                                    buf.clear()
+                                    last_flush = time.monotonic()
+                                    continue
+                                # A dead reader with a drained queue means
+                                # the stream is over even if the terminal
+                                # sentinel was dropped on a full queue.
+                                if not reader.is_alive() and chunk_q.empty():
+                                    break
+                                # SSE comment: ignored by EventSource but
+                                # stops proxies and LBs from idling out the
+                                # connection during long tool calls.
+                                yield b": keepalive\n\n"
+                                last_flush = time.monotonic()
+                                continue
+                            if kind == "done":
+                                break
+                            if kind == "error":
                                 error_data = {
                                     "type": "error",
-                                    "error": f"MCP client error: {event_source.response.status_code}",
-                                    "timestamp": datetime.now().isoformat()
+                                    "error": item,
+                                    "timestamp": _error_timestamp()
                                 }
-                                yield f"data: {json.dumps(error_data)}\n\n"
+                                yield _json_frame(error_data)
                                 return
-                            
-                            for sse in event_source.iter_sse():
-                                yield f"data: {sse.data}\n\n"
-                                    
+                            buf += item
+                            now = time.monotonic()
+                            if (
+                                len(buf) >= flush_bytes
+                                or now - last_flush >= flush_interval
+                            ):
+                                if _client_disconnected(client_sock):
+                                    # Stop pulling LLM output for a reader
+                                    # that is gone.
+                                    logger.debug(
+                                        "SSE client gone; aborting stream"
+                                    )
+                                    _abort()
+                                    return
+                                yield bytes(buf)
+                                buf.clear()
+                                last_flush = now
+                        if buf:
+                            yield bytes(buf)
+                    finally:
+                        _release_buffer(buf)
+
+                except GeneratorExit:
+                    # The browser went away mid-stream; signal the reader so
+                    # it releases the upstream connection, then unwind.
+                    logger.debug("SSE client disconnected before stream end")
+                    _abort()
+                    raise
                 except Exception as e:
                     logger.error(f"Streaming error: {e}")
                     error_data = {
                         "type": "error", 
                         "error": str(e),
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": _error_timestamp()
                     }
-                    yield f"data: {json.dumps(error_data)}\n\n"
+                    # keep the generator byte-homogeneous for the WSGI layer
+                    yield _json_frame(error_data)
 
+            # Superset is deployed as a WSGI app (gunicorn), so the generator
+            # stays synchronous; stream_with_context keeps the request context
+            # alive while chunks are written instead of buffering the body.
             return Response(
-                generate_stream(),
+                stream_with_context(generate_stream()),
                 mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'Connection': 'keep-alive',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': '*',
-                }
+                headers=_SSE_RESPONSE_HEADERS
             )
 
         except Exception as e:
@@ -172,16 +540,41 @@ class McpClientApi(BaseApi):
                       default:
                         type: string
         """
+        if _MODELS_CACHE["data"] is not None and time.monotonic() < _MODELS_CACHE["exp"]:
+            response = self.response(200, result=_MODELS_CACHE["data"])
+            response.headers["Cache-Control"] = f"max-age={int(_MODELS_CACHE_TTL)}"
+            return response
+
         try:
-            with httpx.Client(timeout=10.0) as client:
-                response = client.get(f"{self.mcp_client_url}/models")
+            # Revalidate an expired cache entry cheaply: if the upstream
+            # answers 304 Not Modified we skip re-downloading and re-parsing
+            # the model list and just extend the TTL.
+            headers: Dict[str, str] = {}
+            if _MODELS_CACHE["etag"] and _MODELS_CACHE["data"] is not None:
+                headers["If-None-Match"] = _MODELS_CACHE["etag"]
+            response = _fetch_json(
+                f"{self.mcp_client_url}/models", timeout=10.0, headers=headers
+            )
+            if response.status_code == 304:
+                with _MODELS_CACHE_LOCK:
+                    _MODELS_CACHE["exp"] = time.monotonic() + _MODELS_CACHE_TTL
+                result = _MODELS_CACHE["data"]
+            else:
                 response.raise_for_status()
-                
                 result = response.json()
-                return self.response(200, result=result)
+                with _MODELS_CACHE_LOCK:
+                    _MODELS_CACHE["data"] = result
+                    _MODELS_CACHE["exp"] = time.monotonic() + _MODELS_CACHE_TTL
+                    _MODELS_CACHE["etag"] = response.headers.get("etag")
+            response = self.response(200, result=result)
+            response.headers["Cache-Control"] = f"max-age={int(_MODELS_CACHE_TTL)}"
+            return response
 
         except Exception as e:
             logger.error(f"Failed to get models from MCP client: {e}")
+            # Serve a stale cache entry before resorting to the hardcoded list
+            if _MODELS_CACHE["data"] is not None:
+                return self.response(200, result=_MODELS_CACHE["data"])
             # Return fallback models
             fallback_models = {
                 "models": [
@@ -210,13 +603,12 @@ class McpClientApi(BaseApi):
               description: Health status
         """
         try:
-            with httpx.Client(timeout=5.0) as client:
-                response = client.get(f"{self.mcp_client_url}/health")
-                response.raise_for_status()
-                
-                result = response.json()
-                result["status"] = "connected"
-                return self.response(200, result=result)
+            response = _fetch_json(f"{self.mcp_client_url}/health", timeout=5.0)
+            response.raise_for_status()
+
+            result = response.json()
+            result["status"] = "connected"
+            return self.response(200, result=result)
 
         except Exception as e:
             logger.warning(f"MCP client health check failed: {e}")
@@ -0,0 +1,107 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import time
+from unittest.mock import MagicMock, patch
+
+from superset.app import SupersetApp
+from superset.views import mcp_client_api
+from superset.views.mcp_client_api import McpClientApi
+
+CHAT_PAYLOAD = {"messages": [{"role": "user", "content": "hi"}]}
+
+
+def make_fake_client(frames: list[bytes], status_code: int = 200) -> MagicMock:
+    """Build a mock httpx client whose stream() yields the given SSE frames."""
+    fake_response = MagicMock()
+    fake_response.status_code = status_code
+    fake_response.iter_raw.return_value = iter(frames)
+    fake_response.num_bytes_downloaded = sum(len(f) for f in frames)
+    fake_client = MagicMock()
+    fake_client.stream.return_value.__enter__.return_value = fake_response
+    return fake_client
+
+
+class TestChatStreaming:
+    """Test the SSE proxy generator in views/mcp_client_api.py.
+
+    The upstream read runs on a plain worker thread with no Flask app
+    context, so everything context-bound (config lookups, the pooled
+    client) must be resolved in the request thread before the thread
+    starts. These tests iterate the streamed response end to end to catch
+    regressions there.
+    """
+
+    def chat_response_bytes(self, app: SupersetApp, fake_client: MagicMock) -> bytes:
+        with patch.object(
+            mcp_client_api, "_get_http_client", return_value=fake_client
+        ):
+            with app.test_request_context(
+                "/api/v1/mcp_client/chat", method="POST", json=CHAT_PAYLOAD
+            ):
+                response = McpClientApi().chat()
+                assert response.mimetype == "text/event-stream"
+                return b"".join(response.response)
+
+    def test_chat_streams_upstream_frames(self, app: SupersetApp) -> None:
+        """Upstream SSE frames are forwarded verbatim, not error frames"""
+        frames = [
+            b'data: {"type": "content", "content": "hello"}\n\n',
+            b'data: {"type": "done"}\n\n',
+        ]
+        body = self.chat_response_bytes(app, make_fake_client(frames))
+        assert b"".join(frames) in body
+        assert b'"type": "error"' not in body
+        # the reader thread must not trip over Flask context-bound lookups
+        assert b"application context" not in body
+
+    def test_chat_reports_upstream_http_error(self, app: SupersetApp) -> None:
+        """A non-200 upstream status becomes a single SSE error frame"""
+        body = self.chat_response_bytes(
+            app, make_fake_client([], status_code=503)
+        )
+        assert b'"type":"error"' in body or b'"type": "error"' in body
+        assert b"503" in body
+
+    def test_chat_flushes_buffered_tail_within_deadline(
+        self, app: SupersetApp
+    ) -> None:
+        """A sub-threshold tail is flushed at the flush deadline, not held
+        until the next upstream chunk or keepalive arrives"""
+
+        def slow_frames():
+            yield b'data: {"type": "tool_start"}\n\n'
+            time.sleep(0.5)  # simulated tool execution
+            yield b'data: {"type": "done"}\n\n'
+
+        fake_client = make_fake_client([])
+        stream_ctx = fake_client.stream.return_value.__enter__.return_value
+        stream_ctx.iter_raw.return_value = slow_frames()
+
+        with patch.object(
+            mcp_client_api, "_get_http_client", return_value=fake_client
+        ):
+            with app.test_request_context(
+                "/api/v1/mcp_client/chat", method="POST", json=CHAT_PAYLOAD
+            ):
+                response = McpClientApi().chat()
+                start = time.monotonic()
+                first_chunk = next(iter(response.response))
+                elapsed = time.monotonic() - start
+                assert b"tool_start" in first_chunk
+                # default MCP_SSE_FLUSH_MS is 20ms; well under the 0.5s gap
+                assert elapsed < 0.3